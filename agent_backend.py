@@ -12,6 +12,8 @@ from google.genai import types
 import re
 #from pathlib import Path
 import base64
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from langgraph.graph import StateGraph, START, END
 import streamlit as st
 
@@ -83,8 +85,7 @@ class EvidencePack(BaseModel):
     evidence: List[EvidenceItem] = Field(default_factory=list)
 
 
-class ImageSpec(BaseModel):
-    placeholder: str = Field(..., description="e.g. [[IMAGE_1]]")
+class ImageDetails(BaseModel):
     alt: str
     caption: str
     prompt: str = Field(..., description="Prompt to sent to the image model.")
@@ -92,10 +93,22 @@ class ImageSpec(BaseModel):
     quality: Literal["low", "medium", "high"] = "medium"
 
 
+class ImageSpec(ImageDetails):
+    placeholder: str = Field(..., description="e.g. [[IMAGE_1]]")
+
+
 class GlobalImagePlan(BaseModel):
     md_with_placeholders: str
     images: List[ImageSpec] = Field(default_factory=list)
-    
+
+
+class SectionImageSpec(ImageDetails):
+    task_id: int = Field(..., description="id of the plan task (section) this image belongs after.")
+
+
+class SectionImagePlan(BaseModel):
+    images: List[SectionImageSpec] = Field(default_factory=list)
+
 
 class State(TypedDict):
     topic: str
@@ -108,7 +121,14 @@ class State(TypedDict):
     merged_md: str
     md_with_placeholders: str
     image_specs: List[dict]
-    final: str
+    speculative: bool
+    draft_plan: Optional[Plan]
+    speculation_outcome: str
+    speculation_seconds_saved: float
+    research_seconds: float
+    draft_seconds: float
+    incremental_images: bool
+    pregenerated_images: List[dict]
     
     
     
@@ -149,8 +169,18 @@ def router_node(state: State) -> dict:
         
     }
     
-def route_next(state: State) -> str:
-    return "research" if state["needs_research"] else "orchestrator"
+def route_next(state: State):
+    if not state["needs_research"]:
+        return "orchestrator"
+    # Speculative mode: only hybrid plans are stable enough to draft before research
+    if state.get("speculative") and state["mode"] == "hybrid":
+        return ["research", "speculative_orchestrator"]
+    return "research"
+
+
+def route_after_research(state: State) -> str:
+    # In speculative mode research joins the draft plan at reconcile_plan instead
+    return END if state.get("speculative") and state["mode"] == "hybrid" else "orchestrator"
 
 
 def tavily_search(query: str, max_results: int = 3) -> List[dict]:
@@ -172,6 +202,7 @@ def tavily_search(query: str, max_results: int = 3) -> List[dict]:
 
 
 def research_node(state: State) -> dict:
+    started = time.perf_counter()
     queries = (state.get("queries", []) or [])
     max_results = 3
     raw_results: List[dict] = []
@@ -180,7 +211,7 @@ def research_node(state: State) -> dict:
         raw_results.extend(tavily_search(q, max_results=max_results))
     
     if not raw_results:
-        return {"evidence":[]}
+        return {"evidence":[], "research_seconds":time.perf_counter() - started}
     
     pack = llm.with_structured_output(EvidencePack).invoke(
         [
@@ -209,7 +240,7 @@ def research_node(state: State) -> dict:
         if e.url:
             dedup[e.url] = e
     
-    return {"evidence": list(dedup.values())}
+    return {"evidence": list(dedup.values()), "research_seconds": time.perf_counter() - started}
 
 
 
@@ -295,8 +326,99 @@ def orchestrator(state: State) -> dict:
     return {"plan":plan}
 
 
+# Speculative planning :-
+STOPWORDS = {"with", "that", "this", "from", "your", "what", "when", "into", "using", "about", "their", "they", "have", "more"}
+
+
+def keywords(text: str) -> set:
+    return {w for w in re.findall(r"[a-z0-9][a-z0-9.+#-]{3,}", text.lower()) if w not in STOPWORDS}
+
+
+def speculative_orchestrator(state: State) -> dict:
+    # Closed-book draft, planned without waiting for evidence
+    started = time.perf_counter()
+    draft = orchestrator({**state, "mode": "closed_book", "evidence": []})
+    return {"draft_plan": draft["plan"], "draft_seconds": time.perf_counter() - started}
+
+
+SPECULATION_MIN_COVERAGE = 0.5
+
+
+def match_evidence_to_tasks(plan: Plan, evidence: List[EvidenceItem], background: set) -> dict:
+    # Maps task_id -> evidence items whose best-overlapping section it is.
+    # Topic/query words are excluded: every item shares those, so they say nothing about structure.
+    task_words = {
+        task.id: keywords(f"{task.title} {task.goal} {' '.join(task.bullets)}") - background
+        for task in plan.tasks
+    }
+    
+    matches = {}
+    for e in evidence:
+        words = keywords(f"{e.title} {e.snippet or ''}") - background
+        best_id, best_overlap = None, 1  # need at least 2 shared words
+        for task_id, words_for_task in task_words.items():
+            overlap = len(words & words_for_task)
+            if overlap > best_overlap:
+                best_id, best_overlap = task_id, overlap
+        if best_id is not None:
+            matches.setdefault(best_id, []).append(e)
+    return matches
+
+
+def add_example_bullet(task: Task, e: EvidenceItem) -> Task:
+    # Bullets are capped at 5, so a full task gets the example folded into its last bullet
+    example = f"{e.title} ({e.url})"
+    if len(task.bullets) < 5:
+        bullets = task.bullets + [f"Ground this with a current example: {example}"]
+    else:
+        bullets = task.bullets[:-1] + [f"{task.bullets[-1]} (current example: {example})"]
+    return task.model_copy(update={"bullets": bullets, "requires_research": True, "requires_citations": True})
+
+
+def reconcile_plan(state: State) -> dict:
+    # No LLM call here: the draft is accepted or revised locally, and the workers get the evidence.
+    # If most evidence items map to no section, the draft structure is wrong and we re-plan.
+    draft = state["draft_plan"]
+    evidence = state.get("evidence", []) or []
+    research_seconds = state.get("research_seconds", 0.0)
+    draft_seconds = state.get("draft_seconds", 0.0)
+    
+    background = keywords(" ".join([state["topic"]] + (state.get("queries", []) or [])))
+    matches = match_evidence_to_tasks(draft, evidence, background)
+    covered = sum(len(items) for items in matches.values())
+    
+    if not evidence:
+        plan = draft
+        outcome = "accept"
+    elif covered / len(evidence) >= SPECULATION_MIN_COVERAGE:
+        # Cheap evidence-aware revision: matched sections get a fresh example bullet and must cite it
+        plan = draft.model_copy(update={
+            "tasks": [
+                add_example_bullet(task, matches[task.id][0]) if task.id in matches else task
+                for task in draft.tasks
+            ]
+        })
+        outcome = "revise"
+    else:
+        # Speculation missed: fall back to full evidence-aware planning
+        plan = orchestrator(state)["plan"]
+        outcome = "replan"
+    
+    # A hit overlaps plan generation with research; a miss only loses the time spent waiting on the draft
+    if outcome == "replan":
+        seconds_saved = -max(0.0, draft_seconds - research_seconds)
+    else:
+        seconds_saved = min(research_seconds, draft_seconds)
+    
+    return {
+        "plan": plan,
+        "speculation_outcome": outcome,
+        "speculation_seconds_saved": seconds_saved,
+    }
+
+
 def fanout(state: State):
-    return [
+    sends = [
         Send(
             "worker", 
             {
@@ -309,6 +431,19 @@ def fanout(state: State):
         )
         for task in state["plan"].tasks
     ]
+    
+    # Incremental mode: generate images from the plan while workers are still writing
+    if state.get("incremental_images"):
+        sends.append(
+            Send(
+                "pregenerate_images",
+                {
+                    "topic":state["topic"],
+                    "plan":state["plan"].model_dump(),
+                },
+            )
+        )
+    return sends
 
 
 def worker(payload: dict) -> dict:
@@ -417,16 +552,58 @@ def worker(payload: dict) -> dict:
     return {'sections':[(task.id, section_md)]}
 
 
-def merge_content(state: State) -> dict:
+def join_sections(state: State, after_section: Optional[dict] = None) -> str:
+    # after_section maps task_id -> extra markdown blocks to insert right after that section
     title = state["plan"].blog_title
+    after_section = after_section or {}
     
-    ordered_sections = [md for id, md in sorted(state["sections"], key=lambda x:x[0])] # sort section tuples by task ID and extract only the md content in correct order
+    ordered_sections = [
+        "\n\n".join([md] + after_section.get(id, []))
+        for id, md in sorted(state["sections"], key=lambda x:x[0]) # sort section tuples by task ID and extract only the md content in correct order
+    ]
     body = "\n\n".join(ordered_sections).strip()
-    merged_md = f"# {title}\n\n{body}\n"
-    return {"merged_md": merged_md}
+    return f"# {title}\n\n{body}\n"
+
+
+def merge_content(state: State) -> dict:
+    return {"merged_md": join_sections(state)}
+
+
+MAX_IMAGES = 3
+MAX_IMAGE_CANDIDATES = 5
+
+
+def place_pregenerated_images(state: State) -> dict:
+    # Images already exist; placement and the image cap are decided here.
+    # Successful images fill the cap first; failed candidates only take slots nothing else could use.
+    task_ids = {id for id, _ in state["sections"]}
+    candidates = [
+        img for img in state.get("pregenerated_images", []) or []
+        if img["task_id"] in task_ids
+    ]
+    candidates.sort(key=lambda img: "error" in img)  # stable: keeps the proposed ranking otherwise
+    
+    placeholders_by_task = {}
+    image_specs = []
+    for img in candidates:
+        if len(image_specs) >= MAX_IMAGES:
+            break
+        if img["task_id"] in placeholders_by_task:
+            continue
+        spec = {**img, "placeholder": f"[[IMAGE_{len(image_specs) + 1}]]"}
+        placeholders_by_task[img["task_id"]] = [spec["placeholder"]]
+        image_specs.append(spec)
+    
+    return {
+        "md_with_placeholders": join_sections(state, placeholders_by_task),
+        "image_specs": image_specs,
+    }
 
 
 def decide_images(state: State) -> dict:
+    if state.get("incremental_images"):
+        return place_pregenerated_images(state)
+    
     merged_md = state["merged_md"]
     plan = state["plan"]
     image_plan = llm.with_structured_output(GlobalImagePlan).invoke(
@@ -501,48 +678,163 @@ def gemini_generate_image_bytes(prompt: str) -> bytes:
     raise RuntimeError("No inline image bytes found in response.")
 
 
-def generate_and_place_images(state: State) -> dict:
-    plan = state["plan"]
-    title = state["plan"].blog_title
-    safe_title = re.sub(r'[^a-zA-Z0-9_]', '', title.lower().replace(" ", "_"))
+def generate_image_result(spec: dict) -> dict:
+    # Returns the spec with either raw image_bytes or error filled in
+    # (base64 encoding is deferred to final assembly so it can be streamed)
+    try:
+        return {**spec, "image_bytes": gemini_generate_image_bytes(spec["prompt"])}
+    except Exception as e:
+        return {**spec, "error": str(e)}
+
+
+def pregenerate_images(payload: dict) -> dict:
+    plan = Plan(**payload["plan"])
     
-    md = state.get("md_with_placeholders") or state["merged_md"]
-    image_specs = state.get("image_specs", []) or []
+    outline = "\n".join(
+        f"- [{task.id}] {task.title}: {task.goal} | " + "; ".join(task.bullets)
+        for task in plan.tasks
+    )
     
-    # BLOG_DIR = Path("blogs")
-    # BLOG_DIR.mkdir(exist_ok=True)
+    image_plan = llm.with_structured_output(SectionImagePlan).invoke(
+        [
+            SystemMessage(
+                content=(
+                    """
+                    You are an expert technical editor.
+                    The blog sections are being written right now; you only have the outline.
+                    Propose candidate images/diagrams and which section each belongs to.
+                    The final blog keeps at most 3; the rest are backups if generation fails.
+                    
+                    Rules:
+                    - Max 5 candidates, at most one per section, ordered from most to least useful.
+                    - Each image must materially improve understanding (diagram/flow/table-like visual).
+                    - Use the task id shown in [brackets] as task_id.
+                    - If no images needed: images=[].
+                    - Avoid decorative images; prefer technical diagrams with short labels.
+                    Return strictly SectionImagePlan.
+                    """
+                    )
+                ),
+            HumanMessage(
+                content=(
+                    f"Blog: {plan.blog_title}\n"
+                    f"Blog kind: {plan.blog_kind}\n"
+                    f"Audience: {plan.audience}\n"
+                    f"Topic: {payload['topic']}\n\n"
+                    f"Outline:\n{outline}"
+                )
+            ),
+        ]
+    )
+    
+    # Enforce one candidate per section and the candidate limit before spending any image calls
+    specs = []
+    seen_tasks = set()
+    for img in image_plan.images:
+        if img.task_id in seen_tasks or len(specs) >= MAX_IMAGE_CANDIDATES:
+            continue
+        seen_tasks.add(img.task_id)
+        specs.append(img.model_dump())
+    
+    return {"pregenerated_images": generate_with_backups(specs)}
+
+
+def generate_with_backups(specs: List[dict]) -> List[dict]:
+    # The top MAX_IMAGES candidates are generated concurrently; a backup is only generated when one of them fails
+    if not specs:
+        return []
+    
+    backups = list(enumerate(specs))[MAX_IMAGES:]
+    results = {}
     
-    # if no images requested, just write merged markdown
-    if not image_specs:
-        # filename = f"{safe_title}.md"
-        # output_path = BLOG_DIR / filename
-        # output_path.write_text(md, encoding="utf-8")
-        return {"final":md}
+    with ThreadPoolExecutor(max_workers=MAX_IMAGES) as pool:
+        pending = {pool.submit(generate_image_result, spec): rank for rank, spec in enumerate(specs[:MAX_IMAGES])}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                rank = pending.pop(future)
+                results[rank] = future.result()
+                if "error" in results[rank] and backups:
+                    backup_rank, backup = backups.pop(0)
+                    pending[pool.submit(generate_image_result, backup)] = backup_rank
     
+    # Keep the proposed ranking so placement prefers the most useful images
+    return [results[rank] for rank in sorted(results)]
+
+
+def generate_and_place_images(state: State) -> dict:
+    image_specs = state.get("image_specs", []) or []
     
-    for spec in image_specs:
-        placeholder = spec["placeholder"]
+    # Incremental mode already generated the images (or recorded their failure)
+    resolved = [
+        spec if "image_bytes" in spec or "error" in spec else generate_image_result(spec)
+        for spec in image_specs
+    ]
+    
+    # Placeholders are spliced in by write_final_markdown, so the final document is only materialized once
+    return {"image_specs": resolved}
+
+
+# Final assembly :-
+IMAGE_PLACEHOLDER_RE = re.compile(r"\[\[IMAGE_\d+\]\]")
+BASE64_CHUNK = 3 * 16 * 1024  # multiple of 3 so chunks encode without padding
+
+
+def final_markdown_parts(md: str, image_specs: List[dict]):
+    # Yields str pieces of the document and raw image bytes (to be base64 encoded) in order
+    specs = {spec["placeholder"]: spec for spec in image_specs}
+    pos = 0
+    
+    for match in IMAGE_PLACEHOLDER_RE.finditer(md):
+        spec = specs.get(match.group(0))
+        if spec is None:
+            continue
         
-        try:
-            img_bytes = gemini_generate_image_bytes(spec["prompt"])
-            image_base64 = base64.b64encode(img_bytes).decode("utf-8")
-        except Exception as e:
-            prompt_block = (
+        yield md[pos:match.start()]
+        pos = match.end()
+        
+        if "error" in spec:
+            yield (
                 f"> **[IMAGE GENERATION FAILED]** {spec.get('caption','')}\n>\n"
                 f"> **Alt:** {spec.get('alt','')}\n>\n"
                 f"> **Prompt:** {spec.get('prompt','')}\n>\n"
-                f"> **Error:** {e}\n"
+                f"> **Error:** {spec['error']}\n"
             )
-            md = md.replace(placeholder, prompt_block)
             continue
         
-        img_md = f"![{spec['alt']}](data:image/png;base64,{image_base64})\n*{spec['caption']}*"
-        md = md.replace(placeholder, img_md)
-        
-    # filename = f"{safe_title}.md"
-    # output_path = BLOG_DIR / filename
-    # output_path.write_text(md, encoding="utf-8")
-    return {"final":md}
+        yield f"![{spec['alt']}](data:image/png;base64,"
+        yield spec["image_bytes"]
+        yield f")\n*{spec['caption']}*"
+    
+    yield md[pos:]
+
+
+def final_markdown_size(md: str, image_specs: List[dict]) -> int:
+    # Exact UTF-8 size of the assembled document, e.g. to preallocate a database blob
+    size = 0
+    for part in final_markdown_parts(md, image_specs):
+        if isinstance(part, bytes):
+            size += 4 * ((len(part) + 2) // 3)
+        else:
+            size += len(part.encode("utf-8"))
+    return size
+
+
+def write_final_markdown(md: str, image_specs: List[dict], out) -> int:
+    # Single pass over the placeholders; `out` is any binary writer (file, BytesIO, sqlite3 Blob)
+    written = 0
+    for part in final_markdown_parts(md, image_specs):
+        if isinstance(part, bytes):
+            view = memoryview(part)
+            for start in range(0, len(view), BASE64_CHUNK):
+                chunk = base64.b64encode(view[start:start + BASE64_CHUNK])
+                out.write(chunk)
+                written += len(chunk)
+        else:
+            chunk = part.encode("utf-8")
+            out.write(chunk)
+            written += len(chunk)
+    return written
 
 
 # Build Subgraph
@@ -570,15 +862,21 @@ g = StateGraph(State)
 g.add_node("router", router_node)
 g.add_node("research", research_node)
 g.add_node("orchestrator", orchestrator)
+g.add_node("speculative_orchestrator", speculative_orchestrator)
+g.add_node("reconcile_plan", reconcile_plan)
 g.add_node("worker", worker)
+g.add_node("pregenerate_images", pregenerate_images)
 g.add_node("reducer", reducer_subgraph)
 
 # Edges
 g.add_edge(START, "router")
-g.add_conditional_edges("router", route_next, {"research": "research", "orchestrator": "orchestrator"})
-g.add_edge("research", "orchestrator")
-g.add_conditional_edges("orchestrator", fanout, ["worker"])
+g.add_conditional_edges("router", route_next, ["research", "speculative_orchestrator", "orchestrator"])
+g.add_conditional_edges("research", route_after_research, ["orchestrator", END])
+g.add_edge(["research", "speculative_orchestrator"], "reconcile_plan")
+g.add_conditional_edges("orchestrator", fanout, ["worker", "pregenerate_images"])
+g.add_conditional_edges("reconcile_plan", fanout, ["worker", "pregenerate_images"])
 g.add_edge("worker", "reducer")
+g.add_edge("pregenerate_images", "reducer")
 g.add_edge("reducer", END)
 
 # Build graph
@@ -586,19 +884,26 @@ app = g.compile()
 
 
 # Final function, which our frontend will call
-def generate_blog(topic: str) -> dict:
+def generate_blog(topic: str, speculative: bool = False, incremental_images: bool = False) -> dict:
     result = app.invoke({
         "topic": topic,
-        "mode": "auto"
+        "mode": "auto",
+        "speculative": speculative,
+        "incremental_images": incremental_images,
     })
     
     blog_title = result["plan"].blog_title
-    markdown = result["final"]
+    md = result.get("md_with_placeholders") or result["merged_md"]
+    image_specs = result.get("image_specs", []) or []
     safe_title = re.sub(r'[^a-zA-Z0-9_]', '', blog_title.lower().replace(" ", "_"))
     filename = f"{safe_title}.md"
     
+    # The markdown is not built here; callers stream it into a file or blob with write_markdown(out)
     return{
         "title":blog_title,
-        "markdown":markdown,
-        "filename":filename
+        "filename":filename,
+        "size":final_markdown_size(md, image_specs),
+        "write_markdown":lambda out: write_final_markdown(md, image_specs, out),
+        "speculation_outcome":result.get("speculation_outcome"),
+        "speculation_seconds_saved":result.get("speculation_seconds_saved"),
     }
\ No newline at end of file
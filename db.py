@@ -15,56 +15,136 @@ def init_db():
     )
     """)
     
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS speculation_runs(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        blog_id INTEGER,
+        outcome TEXT,
+        seconds_saved REAL
+    )
+    """)
+    
     conn.commit()
     conn.close()
 
 
-def save_blog(title, filename, markdown):
+def save_blog_stream(title, filename, size, write_markdown):
+    # Preallocates the row and lets write_markdown stream UTF-8 bytes straight into the blob
+    conn = sqlite3.connect(DB_NAME)
+    try:
+        cursor = conn.cursor()
+        
+        cursor.execute(
+            """
+            INSERT INTO blogs 
+            (title, filename, markdown)
+            VALUES (?, ?, zeroblob(?))
+            """,
+            (title, filename, size)
+        )
+        
+        blog_id = cursor.lastrowid
+        with conn.blobopen("blogs", "markdown", blog_id) as blob:
+            write_markdown(blob)
+        
+        conn.commit()
+    finally:
+        conn.close()
+    
+    return blog_id
+    
+    
+def get_blog_by_id(blog_id):
     conn = sqlite3.connect(DB_NAME)
     cursor = conn.cursor()
     
+    # Rows written by save_blog_stream store markdown as a BLOB, older rows as TEXT;
+    # the CAST makes both come back as str. Any other query on this column needs the same CAST.
     cursor.execute(
         """
-        INSERT INTO blogs 
-        (title, filename, markdown)
-        VALUES (?, ?, ?)
+        SELECT filename, CAST(markdown AS TEXT) FROM blogs 
+        WHERE id=?
         """,
-        (title, filename, markdown)
+        (blog_id,)
     )
     
-    conn.commit()
+    row = cursor.fetchone()
     conn.close()
     
+    return (row[0], row[1]) if row else None
+
+
+def count_blogs():
+    conn = sqlite3.connect(DB_NAME)
+    cursor = conn.cursor()
+    
+    cursor.execute("SELECT COUNT(*) FROM blogs")
+    
+    row = cursor.fetchone()
+    conn.close()
     
-def get_all_blogs():
+    return row[0] if row else 0
+
+
+def get_blogs_page(limit, offset=0):
     conn = sqlite3.connect(DB_NAME)
     cursor = conn.cursor()
     
     cursor.execute(
         """
-        SELECT filename FROM blogs
+        SELECT id, filename FROM blogs
         ORDER BY id DESC
-        """)
+        LIMIT ? OFFSET ?
+        """,
+        (limit, offset)
+    )
     
     rows = cursor.fetchall()
     conn.close()
     
-    return [row[0] for row in rows]
+    return [(row[0], row[1]) for row in rows]
 
 
-def get_blog_by_filename(filename):
+def save_speculation_run(blog_id, outcome, seconds_saved):
     conn = sqlite3.connect(DB_NAME)
     cursor = conn.cursor()
     
     cursor.execute(
         """
-        SELECT markdown FROM blogs 
-        WHERE filename=?
+        INSERT INTO speculation_runs 
+        (blog_id, outcome, seconds_saved)
+        VALUES (?, ?, ?)
         """,
-        (filename,)
+        (blog_id, outcome, seconds_saved)
     )
     
-    row = cursor.fetchone()
+    conn.commit()
+    conn.close()
+
+
+def get_speculation_stats():
+    # accept/revise runs skipped the post-research plan generation; replan runs did not
+    conn = sqlite3.connect(DB_NAME)
+    cursor = conn.cursor()
+    
+    cursor.execute(
+        """
+        SELECT 
+            COUNT(*),
+            COALESCE(SUM(outcome = 'accept'), 0),
+            COALESCE(SUM(outcome = 'revise'), 0),
+            COALESCE(SUM(outcome = 'replan'), 0),
+            COALESCE(SUM(seconds_saved), 0)
+        FROM speculation_runs
+        """)
+    
+    runs, accepted, revised, replanned, seconds_saved = cursor.fetchone()
     conn.close()
     
-    return row[0] if row else None
\ No newline at end of file
+    return {
+        "runs": runs,
+        "accept": accepted,
+        "revise": revised,
+        "replan": replanned,
+        "seconds_saved": seconds_saved,
+    }
@@ -1,25 +1,118 @@
 import streamlit as st
 #import os
 from agent_backend import generate_blog
-from db import init_db, save_blog, get_all_blogs, get_blog_by_filename
+from db import (
+    init_db, save_blog_stream, count_blogs, get_blogs_page, get_blog_by_id,
+    save_speculation_run, get_speculation_stats
+)
+
+BLOGS_PER_PAGE = 20
+SECTIONS_PER_LOAD = 3
 
 init_db()
 
 if "selected_blog" not in st.session_state:
     st.session_state["selected_blog"] = None
+if "blog_page" not in st.session_state:
+    st.session_state["blog_page"] = 0
+if "sections_shown" not in st.session_state:
+    st.session_state["sections_shown"] = SECTIONS_PER_LOAD
+if "download_ready" not in st.session_state:
+    st.session_state["download_ready"] = False
+
+
+# Cached data access
+# The list and count change on every save, so they are cleared in save_blog_and_invalidate.
+@st.cache_data(show_spinner=False)
+def cached_blog_count():
+    return count_blogs()
+
+
+@st.cache_data(show_spinner=False)
+def cached_blogs_page(page):
+    return get_blogs_page(BLOGS_PER_PAGE, page * BLOGS_PER_PAGE)
+
+
+@st.cache_data(show_spinner=False)
+def cached_speculation_stats():
+    return get_speculation_stats()
+
+
+# Saved rows never change, so documents are cached as shared objects (no per-rerun unpickling).
+# Only the section list is kept; the full text is rebuilt from it when a download is prepared.
+@st.cache_resource(show_spinner=False, max_entries=16)
+def cached_blog(blog_id):
+    blog = get_blog_by_id(blog_id)
+    if not blog:
+        return None
+    filename, content = blog
+    
+    # Split on H1/H2 headings outside code fences so long posts can be rendered piece by piece
+    sections = []
+    current = []
+    in_fence = False
+    
+    for line in content.splitlines(keepends=True):
+        if line.lstrip().startswith("```"):
+            in_fence = not in_fence
+        if not in_fence and (line.startswith("# ") or line.startswith("## ")) and current:
+            sections.append("".join(current))
+            current = []
+        current.append(line)
+    
+    if current:
+        sections.append("".join(current))
+    return filename, tuple(sections)
+
+
+def save_blog_and_invalidate(blog):
+    # The only save path: every insert clears the list/count caches
+    blog_id = save_blog_stream(blog["title"], blog["filename"], blog["size"], blog["write_markdown"])
+    if blog.get("speculation_outcome"):
+        save_speculation_run(blog_id, blog["speculation_outcome"], blog["speculation_seconds_saved"])
+        cached_speculation_stats.clear()
+    cached_blog_count.clear()
+    cached_blogs_page.clear()
+
+
+def select_blog(blog_id):
+    st.session_state["selected_blog"] = blog_id
+    st.session_state["sections_shown"] = SECTIONS_PER_LOAD
+    st.session_state["download_ready"] = False
+
+
+def set_download_ready(ready):
+    st.session_state["download_ready"] = ready
 
 
 st.title("AI Technical Blog Writer")
 
 # Sidebar
 st.sidebar.title("Saved Blogs")
-files = get_all_blogs()
-selected_blog = None
+total = cached_blog_count()
+num_pages = max(1, (total + BLOGS_PER_PAGE - 1) // BLOGS_PER_PAGE)
+page = min(st.session_state["blog_page"], num_pages - 1)
+files = cached_blogs_page(page)
 
 if files:
-    for filename in files:
-        if st.sidebar.button(filename, use_container_width=True):
-            st.session_state["selected_blog"] = filename
+    for blog_id, filename in files:
+        st.sidebar.button(
+            filename,
+            key=f"blog_{blog_id}",
+            use_container_width=True,
+            on_click=select_blog,
+            args=(blog_id,)
+        )
+    
+    if num_pages > 1:
+        prev_col, info_col, next_col = st.sidebar.columns([1, 2, 1])
+        if prev_col.button("◀", disabled=page == 0):
+            st.session_state["blog_page"] = page - 1
+            st.rerun()
+        info_col.caption(f"Page {page + 1} of {num_pages}")
+        if next_col.button("▶", disabled=page >= num_pages - 1):
+            st.session_state["blog_page"] = page + 1
+            st.rerun()
 else:
     st.sidebar.info("No blogs yet.")
 
@@ -31,6 +124,21 @@ tab1, tab2 = st.tabs(["📝 Generate Blog", "📖 View Blog"])
 with tab1:
     st.header("Generate New Blog")
     topic = st.text_input("Enter Blog Topic")
+    speculative = st.checkbox(
+        "Speculative planning",
+        help="Draft the outline while web research runs, then reconcile it with the evidence (hybrid topics only)."
+    )
+    stats = cached_speculation_stats()
+    if stats["runs"]:
+        st.caption(
+            f"Speculation over {stats['runs']} runs: {stats['accept']} accepted, "
+            f"{stats['revise']} revised, {stats['replan']} re-planned "
+            f"({stats['seconds_saved']:.0f}s saved in total)"
+        )
+    incremental_images = st.checkbox(
+        "Generate images while writing",
+        help="Pick diagrams from the outline and generate them while sections are being written."
+    )
 
     if st.button("Generate Blog"):
         if topic.strip() == "":
@@ -40,9 +148,14 @@ with tab1:
             status.write("Generation in process...")
             
             with st.spinner("Generating blog... (Check back after 2-3 minutes)"):
-                blog = generate_blog(topic)
+                blog = generate_blog(
+                    topic,
+                    speculative=speculative,
+                    incremental_images=incremental_images
+                )
     
-            save_blog(blog["title"], blog["filename"], blog["markdown"])
+            save_blog_and_invalidate(blog)
+            st.session_state["blog_page"] = 0
             
             st.success(f"Blog saved in database as {blog['filename']}")
             st.rerun()
@@ -54,17 +167,34 @@ with tab2:
     selected = st.session_state.get("selected_blog")
     
     if selected:
-        content = get_blog_by_filename(selected)
-        if content:
-            st.download_button(
-                label="Download as .md",
-                data=content,
-                file_name=selected,
-                mime="text/markdown"
-            )
-            st.markdown(content)
+        blog = cached_blog(selected)
+        if blog:
+            filename, sections = blog
+            
+            # Only hand the full document to the download button after an explicit request
+            if st.session_state["download_ready"]:
+                st.download_button(
+                    label="Download as .md",
+                    data="".join(sections),
+                    file_name=filename,
+                    mime="text/markdown",
+                    on_click=set_download_ready,
+                    args=(False,)
+                )
+            else:
+                st.button("Prepare download", on_click=set_download_ready, args=(True,))
+            
+            # Render long posts incrementally, a few sections at a time
+            shown = st.session_state["sections_shown"]
+            for section_md in sections[:shown]:
+                st.markdown(section_md)
+            
+            if shown < len(sections):
+                st.caption(f"Showing {shown} of {len(sections)} sections")
+                if st.button("Load more sections"):
+                    st.session_state["sections_shown"] = shown + SECTIONS_PER_LOAD
+                    st.rerun()
         else:
             st.error("Blog not found")
     else:
         st.info("Select a blog from the sidebar")
-      
\ No newline at end of file